@@ -1,6 +1,13 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import joblib
+import os
+import tempfile
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
 
 st.set_page_config(page_title="COE Premium Predictor", layout="centered")
 
@@ -14,82 +21,249 @@ st.write("Predict the **next COE premium** using the latest record + engineered
 def load_model():
     return joblib.load("best_model.joblib")
 
+# Column types of the numeric columns. Counts and premiums fit comfortably in
+# 32 bits; halving the width halves the bytes moved by every later
+# sort/slice. The model scales them to float64.
+NUMERIC_TYPES = {
+    "quota": pa.int32(),
+    "bids_received": pa.int32(),
+    "bids_success": pa.int32(),
+    "bidding_no": pa.int32(),
+    "premium": pa.float32(),
+}
+
+# Bump whenever csv_to_table's output changes, so Parquet copies written by
+# older code are rebuilt instead of reused
+PARQUET_FORMAT = b"2"
+
+# Identifies the CSV a Parquet copy was built from. Compared for equality, not
+# ordering, so a replaced CSV with an older preserved mtime (cp -p, rsync -a,
+# archive extraction) still invalidates the copy.
+def csv_stamp():
+    stat = os.stat("COEBiddingResultsPrices.csv")
+    return f"{stat.st_mtime_ns}:{stat.st_size}".encode()
+
+# Parse the CSV with Arrow and clean the numeric columns with Arrow compute
+# kernels (C++); load_data keeps the result as a Parquet copy.
+# After stripping "," and whitespace, anything float("...") accepts ("12.0",
+# "1.5e4", "+5", ".5") is parsed as float64; other cells become null (then 0).
+# Values that don't fit the narrow type (non-whole or out-of-range counts,
+# premiums beyond float32) are nulled as well instead of failing the cast.
+def csv_to_table():
+    # Stamped before reading, so a CSV edited mid-read fails the next check
+    source = csv_stamp()
+    tbl = pv.read_csv(
+        "COEBiddingResultsPrices.csv",
+        convert_options=pv.ConvertOptions(column_types={c: pa.string() for c in NUMERIC_TYPES}),
+    )
+    numeric_pattern = r"(?i)^[+-]?((\d+\.?\d*|\.\d+)(e[+-]?\d+)?|inf(inity)?|nan)$"
+    for name, typ in NUMERIC_TYPES.items():
+        if name not in tbl.column_names:
+            continue  # reported by the schema check in load_data
+        col = pc.replace_substring(pc.utf8_trim_whitespace(tbl[name]), ",", "")
+        col = pc.if_else(pc.match_substring_regex(col, numeric_pattern), col, None)
+        col = pc.cast(col, pa.float64())
+        if pa.types.is_integer(typ):
+            info = np.iinfo(typ.to_pandas_dtype())
+            fits = pc.and_(
+                pc.equal(pc.floor(col), col),
+                pc.and_(pc.greater_equal(col, info.min), pc.less_equal(col, info.max)),
+            )
+        else:
+            fits = pc.or_(pc.is_inf(col), pc.less_equal(pc.abs(col), np.finfo(np.float32).max))
+        col = pc.if_else(fits, col, None)
+        tbl = tbl.set_column(tbl.column_names.index(name), name, pc.cast(col, typ))
+    return tbl.replace_schema_metadata({b"coe_format": PARQUET_FORMAT, b"source_csv": source})
+
+# The Parquet copy, if it is readable, built from the current CSV and written
+# by the current csv_to_table; otherwise None
+def read_parquet_copy():
+    try:
+        tbl = pq.read_table("COEBiddingResultsPrices.parquet")
+        source = csv_stamp()
+    except (OSError, pa.ArrowException):
+        return None
+    meta = tbl.schema.metadata or {}
+    if meta.get(b"coe_format") != PARQUET_FORMAT or meta.get(b"source_csv") != source:
+        return None
+    return tbl
+
+# Written to a temp file and renamed into place, so a killed process never
+# leaves a truncated copy behind. The copy is only a cache: on a read-only
+# filesystem the write is skipped and the app runs from the in-memory table.
+def write_parquet_copy(tbl):
+    try:
+        fd, tmp = tempfile.mkstemp(dir=".", suffix=".parquet.tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pq.write_table(tbl, f)
+        # mkstemp creates the file owner-only (0600); give it the mode a
+        # normally created file would get under the current umask
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+        os.replace(tmp, "COEBiddingResultsPrices.parquet")
+    except (OSError, pa.ArrowException):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+# Cached on the CSV's mtime so edits to the file invalidate the cleaned frame
 @st.cache_data
-def load_data():
-    return pd.read_csv("COEBiddingResultsPrices.csv")
+def load_data(mtime):
+    # Parsing the CSV text is only done when the Parquet copy is unusable
+    tbl = read_parquet_copy()
+    if tbl is None:
+        tbl = csv_to_table()
+        write_parquet_copy(tbl)
+
+    df = tbl.to_pandas(types_mapper=pd.ArrowDtype)
+
+    # -----------------------------
+    # Validate schema
+    # -----------------------------
+    needed_raw = {"month", "bidding_no", "vehicle_class", "quota", "bids_received", "bids_success", "premium"}
+    missing_raw = needed_raw - set(df.columns)
+    if missing_raw:
+        st.error(f"CSV missing required columns: {sorted(list(missing_raw))}")
+        st.stop()
 
-model = load_model()
-df = load_data()
+    # -----------------------------
+    # Parse & clean
+    # -----------------------------
+    df["month"] = pd.to_datetime(df["month"], errors="coerce")
+    df = df.dropna(subset=["month"])
 
-# -----------------------------
-# Validate schema
-# -----------------------------
-needed_raw = {"month", "bidding_no", "vehicle_class", "quota", "bids_received", "bids_success", "premium"}
-missing_raw = needed_raw - set(df.columns)
-if missing_raw:
-    st.error(f"CSV missing required columns: {sorted(list(missing_raw))}")
-    st.stop()
+    # Cells csv_to_table couldn't parse are null; fill them with 0 and keep
+    # the NUMERIC_TYPES column types through the fill
+    df = df.fillna({c: 0 for c in NUMERIC_TYPES}).astype(
+        {c: pd.ArrowDtype(t) for c, t in NUMERIC_TYPES.items()}
+    )
 
-# -----------------------------
-# Parse & clean
-# -----------------------------
-df["month"] = pd.to_datetime(df["month"], errors="coerce")
-df = df.dropna(subset=["month"])
-
-num_cols = ["quota", "bids_received", "bids_success", "premium", "bidding_no"]
-for c in num_cols:
-    df[c] = (
-        df[c].astype(str)
-             .str.replace(",", "", regex=False)
-             .str.strip()
+    # Integer category codes make the sort and the per-class lookups cheaper
+    # than comparing Python strings
+    df["vehicle_class"] = df["vehicle_class"].astype("category")
+    df = df.sort_values(["vehicle_class", "month", "bidding_no"]).reset_index(drop=True)
+    return df
+
+# Row positions of each class, in month/bidding_no order (df is sorted and has
+# a RangeIndex), so a class's rows are an array slice instead of a mask scan
+@st.cache_data
+def class_rows(mtime):
+    df = load_data(mtime)
+    return {
+        vc: idx.to_numpy(dtype="int64")
+        for vc, idx in df.groupby("vehicle_class", observed=True).groups.items()
+    }
+
+# Ratio features are 0 when the denominator is 0 (e.g. a quota of 0)
+def safe_ratio(num, den):
+    return num / den if den != 0 else 0
+
+# Lag and rolling(3) features of the last premium in one pass over the
+# (up to) 3 premiums before it; missing history gives 0, as with fillna(0)
+def premium_history(premiums):
+    prior = premiums[-4:-1][::-1]  # lag1, lag2, lag3
+    lags = [float(p) for p in prior] + [0.0] * (3 - len(prior))
+    roll_mean_3 = prior.mean() if len(prior) else np.nan
+    roll_std_3 = prior.std(ddof=1) if len(prior) > 1 else 0.0
+    return lags[0], lags[1], lags[2], roll_mean_3, roll_std_3
+
+# Only the latest row of the selected class is fed to the model, and its
+# lag/rolling features depend on just the 3 premiums before it, so build that
+# single row directly instead of engineering the whole class history
+@st.cache_data
+def latest_for_class(mtime, vc):
+    df = load_data(mtime)
+    rows = class_rows(mtime).get(vc)
+    if rows is None:
+        return df.iloc[0:0]
+
+    # The latest row plus up to 3 before it
+    sub = df.iloc[rows[-4:]]
+
+    latest = sub.tail(1)
+    quota = latest["quota"].iloc[0]
+    received = latest["bids_received"].iloc[0]
+    success = latest["bids_success"].iloc[0]
+    month = latest["month"].iloc[0]
+
+    lag1, lag2, lag3, roll_mean_3, roll_std_3 = premium_history(
+        sub["premium"].tail(4).to_numpy(dtype="float64")
     )
-    df[c] = pd.to_numeric(df[c], errors="coerce")
-df[num_cols] = df[num_cols].fillna(0)
 
-df = df.sort_values(["vehicle_class", "month", "bidding_no"]).reset_index(drop=True)
+    # -----------------------------
+    # Feature engineering
+    # -----------------------------
+    # All derived columns are scalars attached in a single assign()
+    return latest.assign(
+        demand_supply_ratio=safe_ratio(received, quota),
+        success_rate=safe_ratio(success, received),
+        year=month.year,
+        month_num=month.month,
+        quarter=month.quarter,
+        premium_lag1=lag1,
+        premium_lag2=lag2,
+        premium_lag3=lag3,
+        premium_roll_mean_3=roll_mean_3,
+        premium_roll_std_3=roll_std_3,
+    )
 
-# -----------------------------
-# Feature engineering
-# -----------------------------
-df["demand_supply_ratio"] = df["bids_received"] / df["quota"].replace(0, pd.NA)
-df["demand_supply_ratio"] = df["demand_supply_ratio"].fillna(0)
-
-df["success_rate"] = df["bids_success"] / df["bids_received"].replace(0, pd.NA)
-df["success_rate"] = df["success_rate"].fillna(0)
-
-df["year"] = df["month"].dt.year
-df["month_num"] = df["month"].dt.month
-df["quarter"] = df["month"].dt.quarter
-
-df["premium_lag1"] = df.groupby("vehicle_class")["premium"].shift(1)
-df["premium_lag2"] = df.groupby("vehicle_class")["premium"].shift(2)
-df["premium_lag3"] = df.groupby("vehicle_class")["premium"].shift(3)
-
-df["premium_roll_mean_3"] = (
-    df.groupby("vehicle_class")["premium_lag1"]
-      .transform(lambda s: s.rolling(3, min_periods=1).mean())
-)
-df["premium_roll_std_3"] = (
-    df.groupby("vehicle_class")["premium_lag1"]
-      .transform(lambda s: s.rolling(3, min_periods=1).std())
-)
-
-for c in ["premium_lag1", "premium_lag2", "premium_lag3", "premium_roll_std_3"]:
-    df[c] = df[c].fillna(0)
-
-expected_cols = [
-    "quota", "bids_success", "bids_received",
-    "demand_supply_ratio", "success_rate",
-    "year", "month_num", "quarter",
-    "premium_lag1", "premium_lag2", "premium_lag3",
-    "premium_roll_mean_3", "premium_roll_std_3",
-    "bidding_no", "vehicle_class"
-]
-
-missing_engineered = set(expected_cols) - set(df.columns)
-if missing_engineered:
-    st.error(f"Engineered columns missing: {sorted(list(missing_engineered))}")
-    st.stop()
+# vehicle_class is categorical, so its categories are already the unique
+# classes without a pass over the column. cache_resource hands back the same
+# list each rerun (it is never mutated) instead of unpickling a copy.
+@st.cache_resource
+def vehicle_class_choices(mtime):
+    df = load_data(mtime)
+    return sorted(df["vehicle_class"].cat.categories.tolist())
+
+model = load_model()
+data_mtime = os.path.getmtime("COEBiddingResultsPrices.csv")
+
+@st.cache_resource
+def model_columns(_model):
+    # Build the model row in the exact column order the pipeline was fitted on.
+    # Its ColumnTransformer selects columns by name, so predict() still needs a
+    # DataFrame rather than a bare NumPy array.
+    fitted = getattr(_model, "feature_names_in_", None)
+    if fitted is not None:
+        return list(fitted)
+    return [
+        "quota", "bids_success", "bids_received",
+        "demand_supply_ratio", "success_rate",
+        "year", "month_num", "quarter",
+        "premium_lag1", "premium_lag2", "premium_lag3",
+        "premium_roll_mean_3", "premium_roll_std_3",
+        "bidding_no", "vehicle_class"
+    ]
+
+expected_cols = model_columns(model)
+
+def build_model_row(mtime, vc, quota_in, received_in, success_in, bidding_no_in):
+    # History features come from the latest record; the row is synthetic, so
+    # build it in one shot from scalars instead of copying and .loc-writing
+    latest = latest_for_class(mtime, vc).iloc[0].to_dict()
+    return pd.DataFrame([{
+        **latest,
+        # Apply overrides
+        "quota": quota_in,
+        "bids_received": received_in,
+        "bids_success": success_in,
+        "bidding_no": bidding_no_in,
+        # Recompute dependent features
+        "demand_supply_ratio": safe_ratio(received_in, quota_in),
+        "success_rate": safe_ratio(success_in, received_in),
+    }], columns=expected_cols)
+
+# Memoized per scenario so re-predicting a combination already explored is a
+# cache hit instead of another row build + model.predict
+@st.cache_data(max_entries=256)
+def predict_scenario(mtime, vc, quota_in, received_in, success_in, bidding_no_in):
+    X_latest = build_model_row(mtime, vc, quota_in, received_in, success_in, bidding_no_in)
+    return float(model.predict(X_latest)[0])
 
 # -----------------------------
 # UI Tabs (polish)
@@ -97,7 +271,7 @@ if missing_engineered:
 tab1, tab2 = st.tabs(["📌 Predictor", "ℹ️ Model Info"])
 
 with tab1:
-    vehicle_classes = sorted(df["vehicle_class"].dropna().unique().tolist())
+    vehicle_classes = vehicle_class_choices(data_mtime)
 
     # Requirement-friendly: "before any option is selected"
     vc_choice = st.selectbox(
@@ -112,11 +286,16 @@ with tab1:
 
     vc = vc_choice
 
-    latest = df[df["vehicle_class"] == vc].sort_values(["month", "bidding_no"]).tail(1)
+    latest = latest_for_class(data_mtime, vc)
     if latest.empty:
         st.error("No records found for this vehicle class.")
         st.stop()
 
+    missing_engineered = set(expected_cols) - set(latest.columns)
+    if missing_engineered:
+        st.error(f"Engineered columns missing: {sorted(list(missing_engineered))}")
+        st.stop()
+
     st.subheader("Latest Record Used (default context)")
     st.dataframe(latest)
 
@@ -144,13 +323,18 @@ with tab1:
     st.subheader("Adjust Scenario Inputs (Optional)")
     st.caption("Scenario testing: you can tweak bidding stats. History features (lags/rolling) remain from the latest record.")
 
-    col1, col2 = st.columns(2)
-    with col1:
-        quota_in = st.number_input("Quota", min_value=0, value=st.session_state[k_quota], step=1, key=k_quota)
-        received_in = st.number_input("Bids Received", min_value=0, value=st.session_state[k_recv], step=1, key=k_recv)
-    with col2:
-        success_in = st.number_input("Bids Successful", min_value=0, value=st.session_state[k_succ], step=1, key=k_succ)
-        bidding_no_in = st.number_input("Bidding No (optional)", min_value=0, value=st.session_state[k_bidno], step=1, key=k_bidno)
+    # A form batches the inputs so editing them doesn't rerun the script;
+    # everything is applied in a single rerun on submit
+    with st.form("scenario"):
+        col1, col2 = st.columns(2)
+        with col1:
+            quota_in = st.number_input("Quota", min_value=0, value=st.session_state[k_quota], step=1, key=k_quota)
+            received_in = st.number_input("Bids Received", min_value=0, value=st.session_state[k_recv], step=1, key=k_recv)
+        with col2:
+            success_in = st.number_input("Bids Successful", min_value=0, value=st.session_state[k_succ], step=1, key=k_succ)
+            bidding_no_in = st.number_input("Bidding No (optional)", min_value=0, value=st.session_state[k_bidno], step=1, key=k_bidno)
+
+        submitted = st.form_submit_button("Predict Next Premium")
 
     # Validation
     if success_in > received_in:
@@ -169,30 +353,18 @@ with tab1:
     with c2:
         st.caption("Tip: Use Reset after switching categories or testing extreme values.")
 
-    # Build model row
-    X_latest = latest[expected_cols].copy()
-
-    # Apply overrides
-    X_latest.loc[:, "quota"] = quota_in
-    X_latest.loc[:, "bids_received"] = received_in
-    X_latest.loc[:, "bids_success"] = success_in
-    X_latest.loc[:, "bidding_no"] = bidding_no_in
-
-    # Recompute dependent features
-    X_latest.loc[:, "demand_supply_ratio"] = (received_in / quota_in) if quota_in != 0 else 0
-    X_latest.loc[:, "success_rate"] = (success_in / received_in) if received_in != 0 else 0
-
-    with st.expander("Show final model input row (what the model actually sees)"):
-        st.dataframe(X_latest)
+    # Only built and sent to the browser when asked for, not on every rerun
+    if st.checkbox("Show final model input row (what the model actually sees)"):
+        st.dataframe(build_model_row(data_mtime, vc, quota_in, received_in, success_in, bidding_no_in))
 
     # Predict
-    if st.button("Predict Next Premium"):
+    if submitted:
         if success_in > received_in:
             st.error("Fix the scenario inputs first: Bids Successful must be ≤ Bids Received.")
             st.stop()
 
         try:
-            pred = model.predict(X_latest)[0]
+            pred = predict_scenario(data_mtime, vc, quota_in, received_in, success_in, bidding_no_in)
             st.success(f"Predicted next premium for {vc}: {pred:,.2f}")
         except Exception as e:
             st.error("Prediction failed:")